@@ -1,20 +1,21 @@
 import os
 import sys
+import csv
 import json
-import time
+import orjson
 import logging
-import requests
-import shutil
-from requests.exceptions import ProxyError, ConnectionError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta, timezone
 from tqdm import tqdm
-import csv
+import pyarrow as pa
+import pyarrow.parquet as pq
+from vbrick_client import BUCKET, TOKEN_CACHE_PATH, VbrickAuthManager, bypass_proxy_for, safe_get
 
 """
 This script authenticates with the Vbrick API, retrieves video metadata and daily view statistics 
 for all active videos uploaded in the past two years, and exports the results to JSON and CSV files.
 It includes robust error handling, token management, and supports proxy configuration.
-The final CSV is moved to a designated network location for further use.
+The final CSV is written directly to a designated network location for further use.
 """
 
 # Enable debug logging
@@ -22,187 +23,171 @@ logging.basicConfig(
     format='%(asctime)s [%(levelname)s] %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S'
 )
-def safe_get(url, headers=None, params=None, proxies=None, retries=3, delay=2):
-    """Safe HTTP GET with retry logic and error handling"""
-    for attempt in range(1, retries + 1):
-        try:
-            logging.debug(f"GET {url} with headers={headers} and params={params}")
-            resp = requests.get(url, headers=headers, params=params, proxies=proxies, timeout=20)
-            resp.raise_for_status()
-            return resp.json()
-        except (ProxyError, ConnectionError) as e:
-            logging.warning(f"Attempt {attempt}/{retries} network error: {e}")
-        except requests.HTTPError as e:
-            logging.error(f"HTTP {e.response.status_code} on GET {url}: {e.response.text}")
-            if e.response.status_code == 429:
-                delay *= 2
-        time.sleep(delay)
-    logging.error(f"Unexpected error on GET {url}: {e}")
-    return None
-
-class VbrickAuthManager:
-    def __init__(self, base_url, api_key, api_secret, proxies=None):
-        self.base_url = base_url.rstrip('/')
-        self.api_key = api_key
-        self.api_secret = api_secret
-        self.proxies = proxies
-        self.token = None
-        self.token_created = 0
-        self.expires_in = 3600
-    
-    def get_token(self):
-        now = time.time()
-        if not self.token or (now - self.token_created) > (self.expires_in - 60):
-            self.refresh_token()
-        return self.token
-    
-    def refresh_token(self):
-        url = f"{self.base_url}/api/v2/authenticate"
-        logging.info(f"Requesting new access token via {url}")
-        
-        headers = {
-            "accept": "application/json",
-            "content-type": "application/json"
-        }
-        payload = {
-            "apiKey": self.api_key,
-            "apiSecret": self.api_secret
-        }
-        
-        try:
-            resp = requests.post(
-                url, 
-                headers=headers, 
-                json=payload, 
-                proxies=self.proxies, 
-                timeout=30
-            )
-            resp.raise_for_status()
-            data = resp.json()
-        except requests.HTTPError as e:
-            logging.error("Authentication failed %s: %s", e.response.status_code, e.response.text)
-            sys.exit(1)
-        except Exception as ex:
-            logging.error("Unexpected error fetching token: %s", ex)
-            sys.exit(1)
-        
-        token = data.get("token")
-        if not token:
-            logging.error("No 'token' field in response: %s", data)
-            sys.exit(1)
-            
-        self.token = token
-        self.expires_in = data.get("expiresIn", self.expires_in)
-        self.token_created = time.time()
-        logging.info("obtained token; expires in %d seconds", self.expires_in)
+# Progress bars redraw at most once a second and are switched off when stderr is not a terminal (scheduled runs, log files)
+PROGRESS_OPTIONS = {"mininterval": 1.0, "disable": not sys.stderr.isatty()}
 
-def fetch_all_active_videos(auth_manager, proxies=None, count=100):
+def fetch_all_active_videos(auth_manager, proxies=None, count=100, from_date=None, on_page=None):
+    # on_page, if given, is called with each page of videos as soon as it arrives so callers can start work early
     videos = []
     scroll_id = None
     
-    # Calculate the date 730 days ago in UTC ISO 8601 format
-    two_year_ago = (datetime.now(timezone.utc) - timedelta(days=730)).isoformat(timespec="milliseconds").replace("+00:00", "Z")
-    logging.debug(f"Fetching videos from date: {two_year_ago}")
+    # Default to the date 730 days ago in UTC ISO 8601 format
+    two_year_ago = from_date or (datetime.now(timezone.utc) - timedelta(days=730)).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+    logging.debug("Fetching videos from date: %s", two_year_ago)
     
     # First request to get total count
     url = f"{auth_manager.base_url}/api/v2/videos/search"
-    headers = {"Authorization": f"Bearer {auth_manager.get_token()}"}
     params = {
         "count": count,
         "status": "Active",
         "fromUploadDate": two_year_ago
     }
     
-    data = safe_get(url, headers=headers, params=params, proxies=proxies)
+    auth_manager.get_token()  # refreshes the session's Authorization header when expired
+    data = safe_get(url, params=params, proxies=proxies, session=auth_manager.session)
     if not data:
         logging.error("Initial request failed, cannot fetch videos.")
         return []
     
     total = data.get("totalVideos", 0)
-    pbar = tqdm(total=total, desc="Fetching Active Videos", unit="video", dynamic_ncols=True)
+    pbar = tqdm(total=total, desc="Fetching Active Videos", unit="video", dynamic_ncols=True, **PROGRESS_OPTIONS)
     
     items = data.get("videos", [])
     videos.extend(items)
+    if on_page:
+        on_page(items)
     pbar.update(len(items))
     scroll_id = data.get("scrollId")
+    # The cursor itself may legitimately repeat between pages, so loops are detected on the videos returned instead
+    seen_ids = {v.get("id") for v in items}
     
     while scroll_id:
-        params[scroll_id] = scroll_id
-        data = safe_get(url, headers=headers, params=params, proxies=proxies)
+        # Same search filters as the first page; the cursor selects the next page
+        params["scrollId"] = scroll_id
+        auth_manager.get_token()
+        data = safe_get(url, params=params, proxies=proxies, session=auth_manager.session)
         if not data:
             break 
         
-        items = data.get("videos", [])
+        items = [v for v in data.get("videos", []) if v.get("id") not in seen_ids]
         if not items:
+            # Either the last page, or the server handed back a page we already have
             break
+        seen_ids.update(v.get("id") for v in items)
             
         videos.extend(items)
+        if on_page:
+            on_page(items)
         pbar.update(len(items))
         scroll_id = data.get("scrollId")
-        time.sleep(0.1)
     
     pbar.close()
     logging.info(f"Fetched {len(videos)} videos total")
     return videos
 
-# def fetch_all_active_videos(auth_manager, proxies=None, count=100):
-#     videos = []
-#     scroll_id = None
-#     pbar = tqdm(desc="Fetching Active Videos", unit="video", leave=False)
-    
-#     # Calculate the date 730 days ago in UTC ISO 8601 format
-#     two_year_ago = (datetime.now(timezone.utc) - timedelta(days=730)).isoformat(timespec="milliseconds").replace("+00:00", "Z")
-#     logging.debug(f"Fetching videos from date: {two_year_ago}")
-    
-#     while True:
-#         url = f"{auth_manager.base_url}/api/v2/videos/search"
-#         headers = {"Authorization": f"Bearer {auth_manager.get_token()}"}
-#         params = {
-#             "count": count,
-#             "status": "Active",
-#             "fromUploadDate": two_year_ago
-#         }
-#         if scroll_id:
-#             params["scrollId"] = scroll_id
-        
-#         logging.debug(f"Requesting videos with scrollId={scroll_id}")
-#         data = safe_get(url, headers=headers, params=params, proxies=proxies)
-#         if not data:
-#             break
-
-#         items = data.get("videos", [])
-#         logging.debug(f"Fetched {len(items)} videos")
-#         if not items:
-#             break
-    
-#         videos.extend(items)
-#         pbar.update(len(items))
-        
-#         scroll_id = data.get("scrollId")
-#         if not scroll_id:
-#             break
-        
-#         time.sleep(0.1)
-    
-#     pbar.close()
-#     logging.info(f"Total active videos fetched: %d", len(videos))
-#     return videos
-
 def get_video_summary(video_id, auth_manager, start_date=None, end_date=None, proxies=None):
     url = f"{auth_manager.base_url}/api/v2/videos/{video_id}/summary-statistics"
-    headers = {
-        "Authorization": f"Bearer {auth_manager.get_token()}",
-        "Accept": "application/json"
-    }
     params = {}
     if start_date:
         params["after"] = start_date
     if end_date:
         params["before"] = end_date
     
-    data = safe_get(url, headers=headers, params=params, proxies=proxies)
+    auth_manager.get_token()
+    data = safe_get(url, params=params, proxies=proxies, session=auth_manager.session)
     return data if data else {}
 
+# Grouped device/browser columns are a fixed set, so the CSV header is known before any row is written
+DEVICE_GROUPS = ("Desktop", "Mobile", "Other Device")
+BROWSER_GROUPS = ("Chrome", "Microsoft Edge", "Other Browser")
+GROUP_COLUMNS = tuple(sorted(DEVICE_GROUPS + BROWSER_GROUPS))
+FIELDNAMES = (
+    'video_id', 'title', 'playbackUrl', 'duration', 'whenUploaded', 'lastViewed', 'whenPublished',
+    'commentCount', 'score', 'uploadedBy', 'tags', 'date', 'views'
+) + GROUP_COLUMNS
+
+# Every column of the optional Parquet copy has a fixed type so its schema does not vary with each run's data.
+# duration stays a string because the API may send it as hh:mm:ss rather than a number
+PARQUET_COLUMN_TYPES = {
+    **{col: pa.string() for col in ('video_id', 'title', 'playbackUrl', 'duration', 'whenUploaded', 'lastViewed',
+                                    'whenPublished', 'uploadedBy', 'tags', 'date')},
+    'score': pa.float64(),
+    **{col: pa.int64() for col in ('commentCount', 'views') + GROUP_COLUMNS},
+}
+PARQUET_SCHEMA = pa.schema([(col, PARQUET_COLUMN_TYPES[col]) for col in FIELDNAMES])
+
+def group_device_type(device_key):
+    if device_key == 'PC':
+        return 'Desktop'
+    elif device_key == "Mobile Device":
+        return "Mobile"
+    else:
+        return "Other Device"
+
+def group_browser_type(browser_key):
+    if browser_key in ['Chrome', "Chrome Mobile"]:
+        return "Chrome"
+    elif browser_key in ['Microsoft Edge', 'Microsoft Edge mobile']:
+        return "Microsoft Edge"
+    else:
+        return "Other Browser"
+
+def summary_to_rows(meta, summary):
+    """Flatten one video's summary into one CSV row tuple per day, in FIELDNAMES order"""
+    metadata_fields = (
+        meta.get("id"),
+        meta.get("title"),
+        meta.get("playbackUrl"),
+        meta.get("duration"),
+        meta.get("whenUploaded"),
+        meta.get("lastViewed"),
+        meta.get("whenPublished"),
+        meta.get("commentCount"),
+        meta.get("score"),
+        meta.get("uploadedBy"),
+        ", ".join(meta.get("tags", [])) if isinstance(meta.get("tags"), list) else meta.get("tags", "")
+    )
+    
+    # Apply grouping for device and browser statistics
+    device_grouped = {}
+    for d in summary.get('deviceCounts', []):
+        group = group_device_type(d.get('key'))
+        device_grouped[group] = device_grouped.get(group, 0) + d.get('value', 0)
+    
+    browser_grouped = {}
+    for b in summary.get('browserCounts', []):
+        group = group_browser_type(b.get('key'))
+        browser_grouped[group] = browser_grouped.get(group, 0) + b.get('value', 0)
+    
+    # Everything but date/views is constant per video; groups without counts are left empty
+    grouped = {**device_grouped, **browser_grouped}
+    group_values = tuple(grouped.get(col, "") for col in GROUP_COLUMNS)
+    return [(*metadata_fields, day.get('key'), day.get('value'), *group_values) for day in summary.get('totalViewsByDay', [])]
+
+def rows_to_record_batch(rows):
+    """Turn one video's row tuples into a Parquet record batch holding the same values as its CSV lines"""
+    arrays = []
+    for field, values in zip(PARQUET_SCHEMA, zip(*rows)):
+        if pa.types.is_string(field.type):
+            # As in the CSV, missing text is an empty string
+            arrays.append(pa.array(["" if v is None else str(v) for v in values], type=field.type))
+        else:
+            # Safe cast: a fractional count raises instead of being truncated
+            arrays.append(pa.array([None if v in (None, "") else v for v in values]).cast(field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=PARQUET_SCHEMA)
+
+def abandon_parquet(parquet_writer, tmp_path, error):
+    """Close and delete a partly written Parquet copy; the CSV carries on without it"""
+    logging.error("An error occurred while writing %s: %s", tmp_path, error)
+    try:
+        parquet_writer.close()
+    except (OSError, pa.ArrowException):
+        pass
+    try:
+        os.remove(tmp_path)
+    except OSError:
+        pass
+
 def main():
     cfg_path = os.getenv("VBRICK_CONFIG_JSON", "secrets.json")
     if not os.path.exists(cfg_path):
@@ -217,123 +202,112 @@ def main():
     proxy_url = cfg.get("proxies")
     suffix = date.today().isoformat()
     metadata_json = cfg.get("metadata_output", f"video_metadata_{suffix}.json")
-    summary_json = cfg.get("analytics_json", f"video_summary_{suffix}.json")
-    summary_csv = cfg.get("analytics_csv", f"UBS_TV_{suffix}.csv")
+    summary_json = cfg.get("analytics_json", f"video_summary_{suffix}.jsonl")
+    summary_csv = cfg.get("analytics_csv", "Q:/Vbrick/UBS_TV.csv")
+    summary_parquet = cfg.get("analytics_parquet")  # optional Parquet copy of the CSV
+    max_workers = cfg.get("max_workers", 8)
+    # Optional hard ceiling on requests per second for APIs with a published rate limit
+    if cfg.get("max_requests_per_second"):
+        BUCKET.cap(cfg["max_requests_per_second"])
+    token_cache = cfg.get("token_cache", TOKEN_CACHE_PATH)
     
     if not all([base_url, api_key, api_secret]):
         logging.error("base_url, api_key, api_secret required in secrets.json")
         sys.exit(1)
     
     proxies = proxy_url if proxy_url else None
-    auth_mgr = VbrickAuthManager(base_url, api_key, api_secret, proxies)
+    # Runners on the same network as Vbrick can skip the proxy hop (and its CONNECT tunnel) on every request
+    if not cfg.get("use_proxy_for_vbrick", True):
+        proxies = None
+        bypass_proxy_for(base_url)
+    auth_mgr = VbrickAuthManager(base_url, api_key, api_secret, proxies, token_cache)
     
-    # Fetch all videos from past 2 years
+    # Both window bounds are computed once per run
+    two_year_ago = (datetime.now(timezone.utc) - timedelta(days=730)).isoformat(timespec="milliseconds").replace("+00:00", "Z")
     end_date = date.today().isoformat()
 
-    videos = fetch_all_active_videos(auth_mgr, proxies)
-    
-    with open(metadata_json, "w") as mf:
-        json.dump(videos, mf, indent=2)
-    logging.info("Wrote metadata JSON to %s", metadata_json)
-    
-    summary_dict = {}       # Fetch analytics for each video
-    for v in tqdm(videos, desc="Summarizing Videos", unit="video"):
-        vid = v.get("id")
-        when_uploaded = v.get("whenUploaded", "")[:10]
-        # Get video summary statistics
-        stats = get_video_summary(vid, auth_mgr, when_uploaded, end_date, proxies)
-        summary_dict[vid] = {"metadata": v,"dailySummary": stats}
-    
-    with open(summary_json, "w") as jf:                     # Save summary data to JSON
-        json.dump(summary_dict, jf, indent=2)
-    logging.info("Wrote summary JSON to %s", summary_json)
-    
-    # Convert to CSV format
-    rows = []
-    for vid, block in summary_dict.items():
-        meta = block["metadata"]
-        summary = block["dailySummary"]
-        metadata_fields = {
-            "video_id": meta.get("id"),
-            "title": meta.get("title"),
-            "playbackUrl": meta.get("playbackUrl"),
-            "duration": meta.get("duration"),
-            "whenUploaded": meta.get("whenUploaded"),
-            "lastViewed": meta.get("lastViewed"),
-            "whenPublished": meta.get("whenPublished"),
-            "commentCount": meta.get("commentCount"),
-            "score": meta.get("score"),
-            "uploadedBy": meta.get("uploadedBy"),
-            "tags": ", ".join(meta.get("tags", [])) if isinstance(meta.get("tags"), list) else meta.get("tags", "")
-        }
-        
-        # Grouping functions
-        def group_device_type(device_key):
-            if device_key == 'PC':
-                return 'Desktop'
-            elif device_key == "Mobile Device":
-                return "Mobile"
-            else:
-                return "Other Device"
-        
-        def group_browser_type(browser_key):
-            if browser_key in ['Chrome', "Chrome Mobile"]:
-                return "Chrome"
-            elif browser_key in ['Microsoft Edge', 'Microsoft Edge mobile']:
-                return "Microsoft Edge"
-            else:
-                return "Other Browser"
-        
-        # Apply grouping for device and browser statistics
-        device_grouped = {}
-        for d in summary.get('deviceCounts', []):
-            group = group_device_type(d.get('key'))
-            device_grouped[group] = device_grouped.get(group, 0) + d.get('value', 0)
-        
-        browser_grouped = {}
-        for b in summary.get('browserCounts', []):
-            group = group_browser_type(b.get('key'))
-            browser_grouped[group] = browser_grouped.get(group, 0) + b.get('value', 0)
-        
-        # Process daily view data
-        for day in summary.get('totalViewsByDay', []):
-            row = metadata_fields.copy()
-            row['date'] = day.get('key')
-            row['views'] = day.get('value')
-            row.update(device_grouped)
-            row.update(browser_grouped)
-            rows.append(row)
-    
-
-
-
-    # Update header to include all possible keys
-    all_keys = set(k for r in rows for k in r.keys())
-    header = ['video_id', 'title', 'playbackUrl', 'duration', 'whenUploaded', 'lastViewed', 'whenPublished', 'commentCount', 'score', 'uploadedBy', 'tags', 'date', 'views']
-    extra_cols = sorted(k for k in all_keys if k not in header)
-    full_header = header + extra_cols
-    
-
-    # Write to CSV
-    with open(summary_csv, 'w', newline='', encoding='utf-8') as cf:
-        writer = csv.DictWriter(cf, fieldnames=full_header)
-        writer.writeheader()
-        for r in rows:
-            writer.writerow(r)
+    # Fetch analytics for each video, several requests in flight at once, streaming rows to disk as they arrive.
+    # Summaries are queued page by page while the search is still scrolling, so the two stages overlap.
+    # The CSV and the optional Parquet copy are staged beside their destinations and atomically renamed into place
+    # once complete; the Parquet copy is written batch by batch alongside the CSV rather than re-read from the share
+    tmp_csv = f"{summary_csv}.tmp"
+    try:
+        jf = open(summary_json, "wb")
+        cf = open(tmp_csv, "w", newline="", encoding="utf-8", buffering=1024 * 1024)
+    except OSError as e:
+        logging.error("Could not open output files: %s", e)
+        sys.exit(1)
+    tmp_parquet = f"{summary_parquet}.tmp"
+    pw = None
+    if summary_parquet:
+        try:
+            pw = pq.ParquetWriter(tmp_parquet, PARQUET_SCHEMA, compression="zstd")
+        except (OSError, pa.ArrowException) as e:
+            logging.error("An error occurred while writing %s: %s", summary_parquet, e)
+    ex = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        with jf, cf:
+            writer = csv.writer(cf, lineterminator="\n")
+            writer.writerow(FIELDNAMES)
+            futures = {}
+            
+            def submit_page(page):
+                for v in page:
+                    futures[ex.submit(get_video_summary, v.get("id"), auth_mgr, v.get("whenUploaded", "")[:10], end_date, proxies)] = v
+            
+            # Fetch all videos from past 2 years
+            videos = fetch_all_active_videos(auth_mgr, proxies, from_date=two_year_ago, on_page=submit_page)
+            
+            # Compact JSON: the dump is read by tools, not people, and indentation only inflates size and encode time
+            with open(metadata_json, "wb") as mf:
+                mf.write(orjson.dumps(videos))
+            logging.info("Wrote metadata JSON to %s", metadata_json)
+            
+            # Results are written in submission order so UBS_TV.csv and the JSONL keep the same row order from run
+            # to run; later summaries keep downloading while earlier ones are written
+            for fut in tqdm(futures, total=len(futures), desc="Summarizing Videos", unit="video", **PROGRESS_OPTIONS):
+                v = futures[fut]
+                stats = fut.result()
+                # One compact JSON line per summary instead of keeping them all in memory
+                jf.write(orjson.dumps({"id": v.get("id"), "metadata": v, "dailySummary": stats}, option=orjson.OPT_APPEND_NEWLINE))
+                rows = summary_to_rows(v, stats)
+                writer.writerows(rows)
+                if pw and rows:
+                    try:
+                        pw.write_batch(rows_to_record_batch(rows))
+                    except (OSError, pa.ArrowException) as e:
+                        abandon_parquet(pw, tmp_parquet, e)
+                        pw = None
+            cf.flush()
+            os.fsync(cf.fileno())
+        ex.shutdown()
+    except BaseException:
+        # Stop fetching the queued summaries and leave no half-written CSV on the share; the error itself propagates
+        ex.shutdown(cancel_futures=True)
+        try:
+            os.remove(tmp_csv)
+        except OSError:
+            pass
+        if pw:
+            abandon_parquet(pw, tmp_parquet, "run aborted")
+        raise
+    try:
+        os.replace(tmp_csv, summary_csv)
+    except OSError as e:
+        logging.error("An error occurred while writing %s: %s", summary_csv, e)
+        if pw:
+            abandon_parquet(pw, tmp_parquet, "CSV could not be moved into place")
+        sys.exit(1)
+    logging.info("Wrote summary JSON lines to %s", summary_json)
     logging.info("Wrote summary CSV to %s", summary_csv)
     
-    # Define source and destination paths
-    source_path = f"P:/IMPORTANT/Projects/Vbrick/UBS_TV_{suffix}.csv"
-    destination_path = f"Q:/Vbrick/UBS_TV.csv"
-    
-    # Move the file
-    try:
-        shutil.move(source_path, destination_path)
-        logging.info("File moved successfully from %s to %s", source_path, destination_path)
-    except FileNotFoundError:
-        logging.warning("The source file was not found: %s", source_path)
-    except Exception as e:
-        logging.error("An error occurred while moving file: %s", e)
+    if pw:
+        try:
+            pw.close()
+            os.replace(tmp_parquet, summary_parquet)
+            logging.info("Wrote summary Parquet to %s", summary_parquet)
+        except (OSError, pa.ArrowException) as e:
+            abandon_parquet(pw, tmp_parquet, e)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
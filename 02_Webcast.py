@@ -1,76 +1,99 @@
 import os
 import sys
 import json
-import time
+import orjson
 import logging
-import requests
-import csv
-import shutil
+import hashlib
+import pickle
 from datetime import datetime, timezone
 from tqdm import tqdm
 from collections import Counter
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.feature_extraction import text
-from sklearn.cluster import KMeans
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import Normalizer
 from sklearn.metrics import silhouette_score
+from joblib import Parallel, delayed
 import numpy as np
+from vbrick_client import TOKEN_CACHE_PATH, VbrickAuthManager, bypass_proxy_for, safe_get
 
 # Logging setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 
-def safe_get(url, headers=None, params=None, proxies=None, retries=3, delay=2):
-    for attempt in range(retries):
-        try:
-            resp = requests.get(url, headers=headers, params=params, proxies=proxies, timeout=20)
-            resp.raise_for_status()
-            return resp.json()
-        except Exception as e:
-            logging.warning(f"Attempt {attempt+1}/{retries} failed: {e}")
-            time.sleep(delay)
-    return None
+# Progress bars redraw at most once a second and are switched off when stderr is not a terminal
+PROGRESS_OPTIONS = {"mininterval": 1.0, "disable": not sys.stderr.isatty()}
+
+class _DefMap(dict):
+    # Unknown keys group into "Other"; raw values are only normalized on a miss
+    def __missing__(self, key):
+        normalized = str(key).strip() if key else "Other"
+        return self.get(normalized, "Other")
 
-class VbrickAuthManager:
-    def __init__(self, base_url, api_key, api_secret, proxies=None):
-        self.base_url = base_url.rstrip('/')
-        self.api_key = api_key
-        self.api_secret = api_secret
-        self.proxies = proxies
-        self.token = None
-        self.token_created = 0
-        self.expires_in = 3600
+ZONE_MAP = _DefMap({
+    "APAC": "APAC",
+    "APAC CS": "APAC",
+    "APAC Cloud VDI's & Surface Device's": "APAC",
+    "America": "America",
+    "America CS": "America",
+    "America Cloud VDI's & Surface Device's": "America",
+    "Core HLS(Connect Me / Remote User)": "Other",
+    "DefaultZone": "Other",
+    "EMEA": "EMEA",
+    "EMEA CS": "EMEA",
+    "EMEA Cloud VDI's & Surface Device's": "EMEA",
+    "None": "Other",
+    "Secure Web Gateway Zone for Surface Device(Direct)": "Other",
+    "Secure Web Gateway Zone for Surface Device(Direct).1": "Other",
+    "Swiss": "Swiss",
+    "Swiss CS": "Swiss",
+    "Swiss Cloud VDI's & Surface Device's": "Swiss",
+    "UBS Card Center": "Other",
+    "Z - Fallback": "Other"
+})
 
-    def get_token(self):
-        if not self.token or (time.time() - self.token_created) > (self.expires_in - 60):
-            self._refresh_token()
-        return self.token
+BROWSER_MAP = _DefMap({
+    "Chrome": "Chrome",
+    "Chrome mobile": "Chrome",
+    "Microsoft Edge": "Edge",
+    "Microsoft Edge mobile": "Edge",
+    "Android WebView": "Other",
+    "Apple Mail": "Other",
+    "Chrome Mobile": "Chrome",
+    "Firefox": "Other",
+    "Mozilla": "Other",
+    "None": "Other",
+    "Opera": "Other",
+    "Safari": "Other",
+    "Safari mobile": "Other",
+    "Unknown": "Other"
+})
 
-    def _refresh_token(self):
-        url = f"{self.base_url}/api/v2/authenticate"
-        payload = {"apiKey": self.api_key, "apiSecret": self.api_secret}
-        headers = {"accept": "application/json", "content-type": "application/json"}
-        resp = requests.post(url, headers=headers, json=payload, proxies=self.proxies)
-        resp.raise_for_status()
-        data = resp.json()
-        self.token = data["token"]
-        self.expires_in = data.get("expiresIn", 3600)
-        self.token_created = time.time()
+DEVICE_MAP = _DefMap({
+    "PC": "PC",
+    "Mobile Device": "Mobile",
+    "None": "Other",
+    "Unknown": "Other"
+})
 
 def fetch_webcasts(auth_mgr, start_date, end_date):
     url = f"{auth_mgr.base_url}/api/v2/scheduled-events"
-    headers = {"Authorization": f"Bearer {auth_mgr.get_token()}"}
+    auth_mgr.get_token()  # refreshes the session's Authorization header when expired
     params = {
         "after": start_date,
         "before": end_date,
         "sortField": "startDate",
         "sortDirection": "asc"
     }
-    data = safe_get(url, headers=headers, params=params, proxies=auth_mgr.proxies)
+    data = safe_get(url, params=params, proxies=auth_mgr.proxies, session=auth_mgr.session)
     return data if isinstance(data, list) else []
 
 def fetch_attendance(auth_mgr, event_id):
     base_url = f"{auth_mgr.base_url}/api/v2/scheduled-events/{event_id}/post-event-report"
-    headers = {"Authorization": f"VBrick {auth_mgr.get_token()}"}
+    headers = auth_mgr.vbrick_headers()
     all_sessions = []
     scroll_id = None
     page_count = 0
@@ -79,7 +102,7 @@ def fetch_attendance(auth_mgr, event_id):
     
     while True:
         params = {"scrollId": scroll_id} if scroll_id else {}
-        data = safe_get(base_url, headers=headers, params=params, proxies=auth_mgr.proxies)
+        data = safe_get(base_url, headers=headers, params=params, proxies=auth_mgr.proxies, session=auth_mgr.session)
         if not data:
             return None
         # logging.warning(f"No data returned for event {event_id}.")
@@ -117,6 +140,24 @@ def parse_duration_to_seconds(duration_str):
     except Exception:
         return 0
 
+DURATION_PLACE_VALUES = np.array([36000, 3600, 600, 60, 10, 1], dtype=np.int64)
+
+def total_duration_seconds(durations):
+    # Sum fixed-width "HH:MM:SS" strings in bulk by viewing their bytes as a uint8 matrix.
+    # Entries are padded to 9 bytes so over-long values can be told apart from truncated ones
+    if not durations:
+        return 0
+    try:
+        chars = np.array(durations, dtype="S9").view(np.uint8).reshape(-1, 9)
+    except (UnicodeEncodeError, ValueError):
+        return sum(parse_duration_to_seconds(d) for d in durations)
+    digits = chars[:, [0, 1, 3, 4, 6, 7]].astype(np.int64) - 48
+    valid = (chars[:, 2] == 58) & (chars[:, 5] == 58) & (chars[:, 8] == 0) & ((digits >= 0) & (digits <= 9)).all(axis=1)
+    total = int((digits[valid] @ DURATION_PLACE_VALUES).sum())
+    # Anything not in the fixed-width form goes through the tolerant scalar parser
+    total += sum(parse_duration_to_seconds(durations[i]) for i in np.flatnonzero(~valid))
+    return total
+
 def parse_numeric(value):
     try:
         return int(value)
@@ -134,62 +175,115 @@ def parse_float(value):
 
 
 
-def assign_categories_to_webcasts(webcast_data):
-    logging.info("Starting AI-based categorization of webcast titles...")
-    
-    # Extract titles from webcast data
-    titles = [item["title"] for item in webcast_data if "title" in item]
-    logging.info(f"Extracted {len(titles)} titles for clustering.")
-    
+CLUSTER_CACHE_DIR = "cache"
+LSA_COMPONENTS = 64
+MIN_TITLES_FOR_SWEEP = 20
+SILHOUETTE_SAMPLE_SIZE = 500
+EXTRA_STOP_WORDS = ('ubs', '2024', '2025')
+KMEANS_PARAMS = {"random_state": 42, "batch_size": 256, "n_init": 3}
+K_CANDIDATES = range(2, 11)  # Try cluster sizes from 2 to 10
+TOP_TERMS_PER_CLUSTER = 3
+# Bump whenever the clustering changes in a way the settings below do not capture (e.g. the small-input k heuristic)
+CLUSTER_CACHE_VERSION = 1
+# Everything the cached categories depend on besides the titles; any change here invalidates the cache
+CLUSTER_SETTINGS = repr((
+    CLUSTER_CACHE_VERSION, sorted(text.ENGLISH_STOP_WORDS.union(EXTRA_STOP_WORDS)), LSA_COMPONENTS,
+    MIN_TITLES_FOR_SWEEP, SILHOUETTE_SAMPLE_SIZE, sorted(KMEANS_PARAMS.items()), list(K_CANDIDATES), TOP_TERMS_PER_CLUSTER,
+))
+
+def _fit_k(X, k):
+    kmeans = MiniBatchKMeans(n_clusters=k, **KMEANS_PARAMS).fit(X)
+    # Score on a random subsample for large inputs; silhouette is quadratic in the sample count
+    sample_size = SILHOUETTE_SAMPLE_SIZE if X.shape[0] > SILHOUETTE_SAMPLE_SIZE else None
+    return k, kmeans, silhouette_score(X, kmeans.labels_, sample_size=sample_size, random_state=42)
+
+def top_terms_from_centers(centers, terms, top_n=TOP_TERMS_PER_CLUSTER):
+    top_terms = {}
+    top_n = min(top_n, centers.shape[1])
+    for i, center in enumerate(centers):
+        # Get indices of top N terms with highest centroid weight, in descending order
+        top_indices = np.argpartition(-center, top_n - 1)[:top_n]
+        top_indices = top_indices[np.argsort(-center[top_indices])]
+        top_terms[i] = [terms[ind] for ind in top_indices]
+        logging.debug(f"Cluster {i} top terms: {top_terms[i]}")
+    return top_terms
+
+def cluster_titles(titles):
     # Convert titles into TF-IDF vectors to capture term importance
-    custom_stop_words = list(text.ENGLISH_STOP_WORDS.union(['ubs', '2024', '2025']))
+    custom_stop_words = list(text.ENGLISH_STOP_WORDS.union(EXTRA_STOP_WORDS))
     vectorizer = TfidfVectorizer(stop_words=custom_stop_words)
     X = vectorizer.fit_transform(titles)
     logging.info("TF-IDF vectorization complete.")
     
-    # Determine the optimal number of clusters using silhouette score
-    best_k = 2
-    best_score = -1
-    logging.info("Evaluating optimal number of clusters using silhouette score...")
-    for k in range(2, min(11, len(titles))):  # Try cluster sizes from 2 to 10
-        kmeans = KMeans(n_clusters=k, random_state=42)
-        labels = kmeans.fit_predict(X)
-        score = silhouette_score(X, labels)
-        logging.debug(f"Silhouette score for k={k}: {score:.4f}")
-        if score > best_score:
-            best_k = k
-            best_score = score
-    logging.info(f"Optimal number of clusters determined: k={best_k} with silhouette score={best_score:.4f}")
+    # Project the vocabulary-sized vectors onto 64 latent dimensions (LSA) so each
+    # distance computation during clustering is cheap; small vocabularies are used as-is
+    svd = None
+    if X.shape[1] > LSA_COMPONENTS:
+        svd = TruncatedSVD(n_components=LSA_COMPONENTS, random_state=42)
+        X_reduced = Normalizer(copy=False).fit_transform(svd.fit_transform(X))
+        logging.info(f"Reduced TF-IDF features from {X.shape[1]} to {LSA_COMPONENTS} dimensions.")
+    else:
+        X_reduced = X
     
-    # Fit KMeans clustering with the best number of clusters
-    kmeans = KMeans(n_clusters=best_k, random_state=42)
-    clusters = kmeans.fit_predict(X)
+    if len(titles) < MIN_TITLES_FOR_SWEEP:
+        # Too few titles for silhouette scores to be meaningful; pick k heuristically
+        best_k = min(len(titles), max(2, min(4, len(titles) // 3)))
+        kmeans = MiniBatchKMeans(n_clusters=best_k, **KMEANS_PARAMS).fit(X_reduced)
+        logging.info(f"Only {len(titles)} titles; using k={best_k} without a silhouette sweep.")
+    else:
+        # Determine the optimal number of clusters using silhouette score, fitting the candidates in parallel
+        logging.info("Evaluating optimal number of clusters using silhouette score...")
+        results = Parallel(n_jobs=-1)(delayed(_fit_k)(X_reduced, k) for k in K_CANDIDATES)
+        for k, _, score in results:
+            logging.debug(f"Silhouette score for k={k}: {score:.4f}")
+        best_k, kmeans, best_score = max(results, key=lambda r: r[2])
+        logging.info(f"Optimal number of clusters determined: k={best_k} with silhouette score={best_score:.4f}")
+    clusters = kmeans.labels_
     logging.info("KMeans clustering complete.")
     
-    # Helper function to extract top terms for each cluster
-    def get_top_terms_per_cluster(tfidf_matrix, labels, vectorizer, top_n=3):
-        logging.info("Extracting top terms for each cluster...")
-        # Compute average TF-IDF scores per cluster
-        df = pd.DataFrame(tfidf_matrix.todense()).groupby(labels).mean()
-        terms = vectorizer.get_feature_names_out()
-        top_terms = {}
-        for i, row in df.iterrows():
-            # Get indices of top N terms with highest average TF-IDF scores
-            top_indices = np.argsort(row)[-top_n:][::-1]
-            top_terms[i] = [terms[ind] for ind in top_indices]
-            logging.debug(f"Cluster {i} top terms: {top_terms[i]}")
-        return top_terms
-    
-    # Get top descriptive terms for each cluster
-    top_terms = get_top_terms_per_cluster(X, clusters, vectorizer)
+    # The fitted centroids already are the per-cluster mean vectors; map them back to
+    # term space when clustering ran on the LSA projection
+    logging.info("Extracting top terms for each cluster...")
+    centers = kmeans.cluster_centers_ if svd is None else svd.inverse_transform(kmeans.cluster_centers_)
+    top_terms = top_terms_from_centers(centers, vectorizer.get_feature_names_out())
     # Create readable category names by joining top terms
     category_names = {i: " / ".join(terms).title() for i, terms in top_terms.items()}
     logging.info("Descriptive category names generated.")
     
-    # Assign category names to each webcast item based on cluster label
-    for item, label in zip(webcast_data, clusters):
-        item["category_full"] = category_names[label]
-        logging.info("Webcast items updated with category labels.")
+    # Identical titles always land in the same cluster, so a title -> category map is lossless
+    return {title: category_names[label] for title, label in zip(titles, clusters)}
+
+def assign_categories_to_webcasts(webcast_data, cache_dir=CLUSTER_CACHE_DIR):
+    logging.info("Starting AI-based categorization of webcast titles...")
+    
+    # Extract titles from webcast data
+    titles = [item["title"] for item in webcast_data if "title" in item]
+    logging.info(f"Extracted {len(titles)} titles for clustering.")
+    if not titles:
+        return
+    
+    # Reuse the previous clustering when neither the set of titles nor the clustering settings have changed
+    key = hashlib.sha1("\n".join([CLUSTER_SETTINGS, *sorted(titles)]).encode("utf-8")).hexdigest()
+    cache_path = os.path.join(cache_dir, f"cluster_{key}.pkl")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            title_categories = pickle.load(f)
+        logging.info(f"Reusing cached categories from {cache_path}")
+    else:
+        title_categories = cluster_titles(titles)
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, "wb") as f:
+            pickle.dump(title_categories, f)
+        # Only the latest clustering can ever be reused, so drop the ones it replaces
+        for name in os.listdir(cache_dir):
+            if name.startswith("cluster_") and name.endswith(".pkl") and name != os.path.basename(cache_path):
+                os.remove(os.path.join(cache_dir, name))
+    
+    # Assign category names to each webcast item based on its title's cluster
+    for item in webcast_data:
+        if "title" in item:
+            item["category_full"] = title_categories[item["title"]]
+    logging.info("Webcast items updated with category labels.")
 
 def split_category_and_subcategory(webcast_data):
     for item in webcast_data:
@@ -199,6 +293,21 @@ def split_category_and_subcategory(webcast_data):
         item["subcategory"] = full_category
     logging.info("Split category into 'category' (top term) and 'subcategory' (top 3 terms).")
 
+def rows_to_table(rows, fieldnames):
+    # Build columns explicitly: Table.from_pylist only takes column names from the first row,
+    # and rows without a given dynamic field become nulls, written as empty cells
+    return pa.table({field: [row.get(field) for row in rows] for field in fieldnames})
+
+def write_csv_atomic(table, destination_path):
+    # Stage next to the destination so the final step is an atomic same-filesystem rename
+    # instead of the copy + delete a cross-drive shutil.move falls back to
+    tmp_path = f"{destination_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pacsv.write_csv(table, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, destination_path)
+
 def main():
     with open("secrets.json") as f:
         cfg = json.load(f)
@@ -208,8 +317,15 @@ def main():
     api_secret = cfg.get("api_secret")
     proxy_url = cfg.get("proxies")
     proxies = proxy_url if proxy_url else None
+    # Runners on the same network as Vbrick can skip the proxy hop (and its CONNECT tunnel) on every request
+    if not cfg.get("use_proxy_for_vbrick", True):
+        proxies = None
+        bypass_proxy_for(base_url)
+    max_workers = cfg.get("max_workers", 8)
+    summary_csv = cfg.get("webcast_csv", "Q:/Vbrick/webcast_summary.csv")
+    token_cache = cfg.get("token_cache", TOKEN_CACHE_PATH)
     
-    auth_mgr = VbrickAuthManager(base_url, api_key, api_secret, proxies)
+    auth_mgr = VbrickAuthManager(base_url, api_key, api_secret, proxies, token_cache)
     start_date = "2025-07-01T00:00:00Z"
     end_date = datetime.now(timezone.utc).isoformat()
     
@@ -223,8 +339,8 @@ def main():
     split_category_and_subcategory(webcast_data)
     
 
-    with open("webcast_metadata_categorized.json", "w", encoding="utf-8") as jf:
-        json.dump(webcast_data, jf, indent=2)
+    with open("webcast_metadata_categorized.json", "wb") as jf:
+        jf.write(orjson.dumps(webcast_data))
     logging.info("Webcast metadata written to webcast_metadata_categorized.json")
     
     logging.info(f"Fetched {len(webcast_data)} webcasts. Enriching with attendance data...")
@@ -232,128 +348,74 @@ def main():
     failed_events = []
     dynamic_fields = set()
     
-    zone_mapping = {
-        "APAC": "APAC",
-        "APAC CS": "APAC",
-        "APAC Cloud VDI's & Surface Device's": "APAC",
-        "America": "America",
-        "America CS": "America",
-        "America Cloud VDI's & Surface Device's": "America",
-        "Core HLS(Connect Me / Remote User)": "Other",
-        "DefaultZone": "Other",
-        "EMEA": "EMEA",
-        "EMEA CS": "EMEA",
-        "EMEA Cloud VDI's & Surface Device's": "EMEA",
-        "None": "Other",
-        "Secure Web Gateway Zone for Surface Device(Direct)": "Other",
-        "Secure Web Gateway Zone for Surface Device(Direct).1": "Other",
-        "Swiss": "Swiss",
-        "Swiss CS": "Swiss",
-        "Swiss Cloud VDI's & Surface Device's": "Swiss",
-        "UBS Card Center": "Other",
-        "Z - Fallback": "Other"
-    }
-
-    browser_mapping = {
-        "Chrome": "Chrome",
-        "Chrome mobile": "Chrome",
-        "Microsoft Edge": "Edge",
-        "Microsoft Edge mobile": "Edge",
-        "Android WebView": "Other",
-        "Apple Mail": "Other",
-        "Chrome Mobile": "Chrome",
-        "Firefox": "Other",
-        "Mozilla": "Other",
-        "None": "Other",
-        "Opera": "Other",
-        "Safari": "Other",
-        "Safari mobile": "Other",
-        "Unknown": "Other"
-    }
-
-    device_mapping = {
-        "PC": "PC",
-        "Mobile Device": "Mobile",
-        "None": "Other",
-        "Unknown": "Other"
-    }
-    
     # filtered_data = [w for w in webcast_data if w.get("id") == "1e5ed26b-4080-4813-8cba-870e6051a743"]
     # for webcast in tqdm(filtered_data, desc="Processing Webcasts", unit="webcast"):
 
-    for webcast in tqdm(webcast_data, desc="Processing Webcasts", unit="webcast"):
-        event_id = webcast.get("id")
-        title = webcast.get("title")
-        vodId = webcast.get("linkedVideoId")
-        category = webcast.get("category", "")
-        subcategory = webcast.get("subcategory", "")
-        attendance = fetch_attendance(auth_mgr, event_id)
-        if attendance is None:
-            failed_events.append({"id": event_id, "title": title})
-            continue
-        sessions = attendance.get("sessions", [])
-        # attendee_sessions = [s for s in sessions if s.get("attendeeType") == "Attendee"]
-        attendee_sessions = [s for s in sessions]
-        
-
-        browser_counter = Counter()
-        device_counter = Counter()
-        zone_counter = Counter()
-        viewing_time = 0
+    # Rows are collected in submission order so the CSV keeps the same row order from run to run
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_attendance, auth_mgr, w.get("id")): w for w in webcast_data}
+        for fut in tqdm(futures, total=len(futures), desc="Processing Webcasts", unit="webcast", **PROGRESS_OPTIONS):
+            webcast = futures[fut]
+            event_id = webcast.get("id")
+            title = webcast.get("title")
+            vodId = webcast.get("linkedVideoId")
+            category = webcast.get("category", "")
+            subcategory = webcast.get("subcategory", "")
+            try:
+                attendance = fut.result()
+            except Exception as e:
+                # One broken report (e.g. an auth refresh or a malformed body) should not cost the whole run
+                logging.error(f"Fetching attendance for {event_id} failed: {e}")
+                attendance = None
+            if attendance is None:
+                failed_events.append({"id": event_id, "title": title})
+                continue
+            sessions = attendance.get("sessions", [])
+            # attendee_sessions = [s for s in sessions if s.get("attendeeType") == "Attendee"]
+            attendee_sessions = [s for s in sessions]
         
-        # Inside your session processing loop
-        for session in sessions:
-            # Normalize and map browser
-            raw_browser = session.get("browser")
-            browser = str(raw_browser).strip() if raw_browser else "Other"
-            grouped_browser = browser_mapping.get(browser, "Other")
-            browser_counter[grouped_browser] += 1
-            
-            # Normalize and map device type
-            raw_device = session.get("deviceType")
-            device = str(raw_device).strip() if raw_device else "Other"
-            grouped_device = device_mapping.get(device, "Other")
-            device_counter[grouped_device] += 1
 
-            # Normalize and map zone
-            raw_zone = session.get("zone")
-            zone = str(raw_zone).strip() if raw_zone else "Other"
-            grouped_zone = zone_mapping.get(zone, "Other")
-            zone_counter[grouped_zone] += 1
-            
-            # Viewing time
-            viewing_time += parse_duration_to_seconds(session.get("viewingTime", "00:00:00"))
+            # Map every session in a single pass, then count each dimension in bulk
+            mapped = [
+                (BROWSER_MAP[s.get("browser")], DEVICE_MAP[s.get("deviceType")], ZONE_MAP[s.get("zone")], s.get("viewingTime", "00:00:00"))
+                for s in sessions
+            ]
+            browsers, devices, zones, durations = zip(*mapped) if mapped else ((), (), (), ())
+            browser_counter = Counter(browsers)
+            device_counter = Counter(devices)
+            zone_counter = Counter(zones)
+            viewing_time = total_duration_seconds(durations)
         
-        attendee_total = sum(browser_counter.values())
+            attendee_total = sum(browser_counter.values())
         
-        base_row = {
-            "id": event_id,
-            "title": title,
-            "vodId": vodId,
-            "eventUrl": webcast.get("eventUrl"),
-            "attendeeCount": attendance.get("attendeeCount"),
-            "attendeeTotal": attendee_total,
-            "startDate": webcast.get("startDate"),
-            "endDate": webcast.get("endDate"),
-            "total_viewingTime": viewing_time,
-            "category": category,
-            "subcategory": subcategory
-        }
+            base_row = {
+                "id": event_id,
+                "title": title,
+                "vodId": vodId,
+                "eventUrl": webcast.get("eventUrl"),
+                "attendeeCount": attendance.get("attendeeCount"),
+                "attendeeTotal": attendee_total,
+                "startDate": webcast.get("startDate"),
+                "endDate": webcast.get("endDate"),
+                "total_viewingTime": viewing_time,
+                "category": category,
+                "subcategory": subcategory
+            }
         
-        for key, count in browser_counter.items():
-            col = f"browser_{key}"
-            base_row[col] = count
-            dynamic_fields.add(col)
-        for key, count in device_counter.items():
-            col = f"deviceType_{key}"
-            base_row[col] = count
-            dynamic_fields.add(col)
-        for key, count in zone_counter.items():
-            col = f"zone_{key}"
-            base_row[col] = count
-            dynamic_fields.add(col)
+            for key, count in browser_counter.items():
+                col = f"browser_{key}"
+                base_row[col] = count
+                dynamic_fields.add(col)
+            for key, count in device_counter.items():
+                col = f"deviceType_{key}"
+                base_row[col] = count
+                dynamic_fields.add(col)
+            for key, count in zone_counter.items():
+                col = f"zone_{key}"
+                base_row[col] = count
+                dynamic_fields.add(col)
         
-        rows.append(base_row)
+            rows.append(base_row)
     
     if rows:
     
@@ -361,33 +423,16 @@ def main():
         static_fields = ["id", "title", "vodId", "eventUrl", "attendeeCount", "attendeeTotal", "startDate", "endDate", "total_viewingTime", "category", "subcategory"]
         
         fieldnames = static_fields + sorted(dynamic_fields)
-        with open("webcast_summary.csv", "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            for row in rows:
-                writer.writerow({field: row.get(field, "") for field in fieldnames})
-        logging.info("Webcast summary exported to webcast_summary.csv")
+        table = rows_to_table(rows, fieldnames)
+        try:
+            write_csv_atomic(table, summary_csv)
+            logging.info(f"Webcast summary exported to {summary_csv}")
+        except OSError as e:
+            logging.error(f"An error occurred while writing {summary_csv}: {e}")
     
     if failed_events:
-        with open("failed_webcasts.csv", "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=["id", "title"])
-            writer.writeheader()
-            writer.writerows(failed_events)
+        pacsv.write_csv(rows_to_table(failed_events, ["id", "title"]), "failed_webcasts.csv")
         logging.info(f"{len(failed_events)} webcasts failed and were logged in failed_webcasts.csv")
-    
-
-    # Define source and destination paths
-    source_path = f"P:/IMPORTANT/Projects/Vbrick/webcast_summary.csv"
-    destination_path = f"Q:/Vbrick/webcast_summary.csv"
-
-    # Move the file
-    try:
-        shutil.move(source_path, destination_path)
-        print("File moved successfully.")
-    except FileNotFoundError:
-        print("The source file was not found.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
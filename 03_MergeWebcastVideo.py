@@ -1,5 +1,8 @@
+import numpy as np
+import os
 import pandas as pd
-import shutil
+import pyarrow as pa
+import pyarrow.csv as pacsv
 
 """
 This script merges video analytics data from UBS_TV.csv with webcast metadata from webcast_summary.csv 
@@ -10,29 +13,28 @@ to create a unified summary report. It performs the following steps:
 2. Filters and renames relevant video columns for clarity and consistency.
 3. Merges the video data with webcast data using a left join on webcast 'vodId' and video 'video_id'.
 4. Replaces missing values with 0 and formats numeric values for regional display (e.g., using commas).
-5. Exports the merged dataset to merged_webcast_video_summary.csv and moves it to a shared network location.
+5. Exports the merged dataset directly to merged_webcast_video_summary.csv on the shared network location.
 
 This script is used to enrich webcast reporting with detailed video performance metrics.
 """
 
 
-# Load the UBS_TV.csv file
-df_video = pd.read_csv('Q:/Vbrick/UBS_TV.csv')
+# Load the UBS_TV.csv file, skipping the free-text columns and the daily "date" breakdown that are never used here
+unused_video_columns = {'title', 'playbackUrl', 'whenUploaded', 'commentCount', 'score', 'uploadedBy', 'tags', 'date'}
+df_video = pd.read_csv(
+    'Q:/Vbrick/UBS_TV.csv',
+    usecols=lambda col: col not in unused_video_columns,
+    dtype={'video_id': str, 'lastViewed': str, 'whenPublished': str},
+    low_memory=False,
+)
 
-# Drop the "date" column since it's used only for daily breakdowns
-df_video = df_video.drop(columns=['date'])
-
-# Dynamically identify all columns except 'video_id' and 'views'
-non_summed_columns = [col for col in df_video.columns if col not in ['video_id', 'views']]
-
-# Aggregate: sum views, take first occurrence of all other columns
-aggregated_df = df_video.groupby("video_id").agg({
-    "views": 'sum',
-    **{col: "first" for col in non_summed_columns}
-}).reset_index()
+# Sum views per video; every other column is constant per video_id, so keep the first row of each video
+views = df_video.groupby('video_id', sort=False, as_index=False)['views'].sum()
+meta = df_video.drop_duplicates('video_id', keep='first').drop(columns=['views'])
+aggregated_df = views.merge(meta, on='video_id', how='left')
 
 # Load the webcast_summary.csv file
-df_webcast = pd.read_csv('Q:/Vbrick/webcast_summary.csv')
+df_webcast = pd.read_csv('Q:/Vbrick/webcast_summary.csv', dtype={'vodId': str}, low_memory=False)
 
 # Identify numeric columns to keep, excluding specific ones
 excluded_columns = {'video_id', 'commentCount', 'score'}
@@ -50,35 +52,36 @@ merged_df = df_webcast.merge(aggregated_df, how='left', left_on='vodId', right_o
 # Drop the redundant join key from video data
 merged_df = merged_df.drop(columns=['video_id'])
 
-# Replace NaN values with 0
-merged_df = merged_df.fillna(0)
-
-# Format numeric values: convert float to int where appropriate and replace '.' with ',' for regional formatting
-def format_number(val):
-    if isinstance(val, float) and val.is_integer():
-        return str(int(val)).replace('.', ',')
-    elif isinstance(val, (float, int)):
-        return str(val).replace('.', ',')
-    return val
+# Replace NaN values with 0: text columns here, float columns in the formatting pass below, integer columns never hold NaN
+# (the filled 0 is stored as text so every column has a single Arrow type when written)
+text_columns = merged_df.select_dtypes(exclude='number').columns
+merged_df[text_columns] = merged_df[text_columns].fillna(0).astype(str)
+
+# Format numeric values: integral floats lose their decimal part, the rest use ',' as decimal separator.
+# Done per column with vectorized masks instead of a Python call per cell
+def format_float_column(col):
+    values = col.to_numpy()
+    is_int = (np.mod(values, 1) == 0) & (np.abs(values) < 2**63)
+    # Each value is stringified once, through the int64 or the float path
+    formatted = np.empty(len(values), dtype=object)
+    formatted[is_int] = values[is_int].astype('int64').astype(str)
+    if not is_int.all():
+        formatted[~is_int] = np.char.replace(values[~is_int].astype(str), '.', ',')
+    return pd.Series(formatted, index=col.index)
 
 # Apply formatting to merged dataframe
-merged_df = merged_df.apply(lambda col: col.map(format_number) if col.dtype != "object" else col)
+for col in merged_df.select_dtypes(include='float').columns:
+    merged_df[col] = format_float_column(merged_df[col].fillna(0))
 
 
-# Save the result
-merged_df.to_csv('merged_webcast_video_summary.csv', index=False)
-
-# Define source and destination paths
-source_path = "P:/IMPORTANT/Projects/Vbrick/merged_webcast_video_summary.csv"
+# Save the result straight to the share: stage next to the destination, then atomically rename it into place
 destination_path = "Q:/Vbrick/merged_webcast_video_summary.csv"
+tmp_path = f"{destination_path}.tmp"
 
-# Move the file
 try:
-    shutil.move(source_path, destination_path)
-    print("File moved successfully to Q:/Vbrick/merged_webcast_video_summary.csv")
-except FileNotFoundError:
-    print("The source file was not found.")
-except Exception as e:
+    with open(tmp_path, 'wb') as f:
+        pacsv.write_csv(pa.Table.from_pandas(merged_df, preserve_index=False), f)
+    os.replace(tmp_path, destination_path)
+    print(f"Join complete. Output saved to {destination_path}")
+except OSError as e:
     print(f"An error occurred: {e}")
-
-print("Join complete. Output saved to 'merged_webcast_video_summary.csv'.")
\ No newline at end of file
@@ -58,7 +58,7 @@ id | title          | browser      | v_views
    - Collect all transformed records into a new DataFrame.
 
 7. **Export Result**:
-   - Save the normalized data to normalized_webcast_video_summary.csv.
+   - Save the normalized data to normalized_webcast_video_summary.csv, staged to a temp file and renamed into place.
 
 Output: A flattened CSV file where each row represents a single dimension-metric combination for a webcast.
 """
@@ -66,14 +66,14 @@ Output: A flattened CSV file where each row represents a single dimension-metric
 
 
 
+import os
 import pandas as pd
-
-# Load the merged webcast dataset
-df = pd.read_csv("Q:/Vbrick/merged_webcast_video_summary.csv")
+import pyarrow as pa
+import pyarrow.csv as pacsv
 
 # Define metadata columns to retain
 metadata_cols = [
-    "id", "title", "vodID", "eventURL", "startDate", "endDate",
+    "id", "title", "vodId", "eventUrl", "startDate", "endDate",
     "total_viewingTime", "category", "subcategory", "v_duration", "v_lastViewed", "v_whenPublished"
 ]
 
@@ -99,45 +99,63 @@ dimension_configs = [
     },
     {
         "dimension_column": "video_browser",
-        "columns": ["v_Chrome", "v_Microsoft Edge", "v_browser Other"],
+        "columns": ["v_Chrome", "v_Microsoft Edge", "v_Other Browser"],
         "labels": ["Chrome", "Microsoft Edge", "Other"],
         "metric_column": "v_views"
     },
     {
         "dimension_column": "video_device",
-        "columns": ["v_Desktop", "v_Mobile", "v_device Other"],
+        "columns": ["v_Desktop", "v_Mobile", "v_Other Device"],
         "labels": ["Desktop", "Mobile", "Other"],
         "metric_column": "v_views"
     }
 ]
 
-# Collect transformed rows
-records = []
-
-for _, row in df.iterrows():
-    base = row[metadata_cols].to_dict()         # Create base record with metadata
-    for config in dimension_configs:
-        for col, label in zip(config["columns"], config["labels"]):
-            if row[col] != 0:
-                record = base.copy()
-                # Initialize all dimension columns to None
-                record.update({
-                    "zone": None,
-                    "webcast_browser": None,
-                    "webcast_device": None,
-                    "video_browser": None,
-                    "video_device": None,
-                    "attendeeTotal": None,
-                    "v_views": None
-                })
-                # Set the current dimension value
-                record[config["dimension_column"]] = label
-                # Set the appropriate metric value
-                record[config["metric_column"]] = row[col]
-                records.append(record)
-
-# Create normalized DataFrame
-normalized_df = pd.DataFrame(records)
-normalized_df.to_csv("Q:/Vbrick/normalized_webcast_video_summary.csv", index=False) # Export to CSV
-
-print(f"Normalized data exported with {len(normalized_df)} records")
\ No newline at end of file
+dimension_cols = [col for config in dimension_configs for col in config["columns"]]
+
+# Load the merged webcast dataset, parsing only the columns used below.
+# Dimension values are kept as parsed: 03 writes them with ',' decimals, so they are not plain floats
+used_cols = set(metadata_cols + dimension_cols)
+df = pd.read_csv("Q:/Vbrick/merged_webcast_video_summary.csv", usecols=lambda col: col in used_cols, low_memory=False)
+
+# Dimension columns are only written upstream when at least one webcast/video had that value
+df = df.reindex(columns=df.columns.union(dimension_cols, sort=False), fill_value=0)
+df["_row"] = range(len(df))
+
+output_cols = metadata_cols + ["zone", "webcast_browser", "webcast_device", "video_browser", "video_device", "attendeeTotal", "v_views"]
+
+# Reshape each dimension from wide to long with one vectorized melt per config
+frames = []
+for dim_order, config in enumerate(dimension_configs):
+    metric = config["metric_column"]
+    id_cols = metadata_cols + ["_row"]
+    # Skip rows with no value in this dimension (e.g. webcasts without a recording) before melting them
+    present = df[(df[config["columns"]] != 0).any(axis=1)]
+    melted = present[id_cols + config["columns"]].melt(id_vars=id_cols, var_name="_source", value_name=metric)
+    melted = melted[melted[metric] != 0]             # Keep only non-zero dimension values
+    melted[config["dimension_column"]] = melted["_source"].map(dict(zip(config["columns"], config["labels"])))
+    melted["_dim"] = dim_order
+    melted["_col"] = melted["_source"].map({col: i for i, col in enumerate(config["columns"])})
+    frames.append(melted)
+
+# Create normalized DataFrame in the original row -> dimension -> label order; unset dimension/metric columns stay empty
+normalized_df = (
+    pd.concat(frames, ignore_index=True)
+    .sort_values(["_row", "_dim", "_col"], kind="stable")
+    .reindex(columns=output_cols)
+)
+# Export to CSV with Arrow's writer; metric columns can mix counts and ','-formatted text, so non-numeric columns are written as text
+text_columns = normalized_df.select_dtypes(exclude="number").columns
+table = pa.Table.from_pandas(normalized_df.astype({col: "string" for col in text_columns}), preserve_index=False)
+
+# Stage next to the destination on the share, then atomically rename it into place
+destination_path = "Q:/Vbrick/normalized_webcast_video_summary.csv"
+tmp_path = f"{destination_path}.tmp"
+
+try:
+    with open(tmp_path, 'wb') as f:
+        pacsv.write_csv(table, f)
+    os.replace(tmp_path, destination_path)
+    print(f"Normalized data exported with {len(normalized_df)} records")
+except OSError as e:
+    print(f"An error occurred: {e}")
\ No newline at end of file
@@ -0,0 +1,274 @@
+import os
+import json
+import orjson
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlparse
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+"""
+HTTP, authentication and rate-limiting helpers shared by the Vbrick fetch scripts
+(01_fetch_analytics.py and 02_Webcast.py). Both scripts talk to the same API host,
+so they share one pooled session type, one retry policy and one token cache.
+"""
+
+def build_session(pool_size=32):
+    """Create a pooled HTTP session so repeated calls reuse keep-alive connections"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=Retry(total=0))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def bypass_proxy_for(url):
+    """Add the host of url to NO_PROXY so requests reaches it directly instead of through an environment proxy"""
+    host = urlparse(url).hostname
+    current = os.environ.get("no_proxy") or os.environ.get("NO_PROXY") or ""
+    if host and host not in current.split(","):
+        os.environ["no_proxy"] = os.environ["NO_PROXY"] = f"{current},{host}" if current else host
+
+class TokenBucket:
+    """Adaptive token bucket shared by worker threads to pace requests to the Vbrick API.
+
+    Each request takes one token; tokens refill at `rate` per second up to `capacity`.
+    Successful responses slowly raise the rate, throttling responses cut it back.
+    """
+    def __init__(self, capacity=20, rate=10, min_rate=1, max_rate=50, increase=0.2, decrease=0.5):
+        self.capacity = capacity
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_failure(self):
+        with self.lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            logging.info("Throttled by server; request rate lowered to %.1f/s", self.rate)
+
+    def cap(self, max_rate):
+        """Make max_rate a hard ceiling: no rate increase and no burst from a full bucket may exceed it"""
+        with self.lock:
+            self._refill()
+            self.max_rate = max_rate
+            self.min_rate = min(self.min_rate, max_rate)
+            self.rate = min(self.rate, max_rate)
+            self.capacity = max(1, min(self.capacity, max_rate))
+            self.tokens = min(self.tokens, self.capacity)
+
+    def observe(self, headers):
+        """Honour X-RateLimit-Remaining/Reset: once the quota is spent, go into token debt until the window resets"""
+        try:
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset = float(headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+        if remaining > 0:
+            return
+        wait = reset - time.time() if reset > 1e9 else reset  # epoch timestamp or seconds until reset
+        if wait > 0:
+            with self.lock:
+                self._refill()
+                self.tokens = min(self.tokens, -wait * self.rate)
+            logging.info("Rate limit quota exhausted; pausing requests for %.1fs", wait)
+
+BUCKET = TokenBucket(capacity=20, rate=10)
+
+def backoff_delay(attempt, base=2, cap=60, retry_after=None):
+    """Exponential backoff with full jitter for a 1-based attempt, never shorter than a server-supplied Retry-After"""
+    delay = random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+    if retry_after:
+        try:
+            wait = float(retry_after)
+        except ValueError:
+            # Retry-After may also be an HTTP date
+            try:
+                wait = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                wait = 0
+        delay = max(delay, wait)
+    return delay
+
+def safe_get(url, headers=None, params=None, proxies=None, retries=3, delay=2, session=None):
+    """Safe HTTP GET with retry logic and error handling; returns the decoded JSON body or None"""
+    http = session or requests
+    for attempt in range(1, retries + 1):
+        retry_after = None
+        try:
+            logging.debug("GET %s with headers=%s and params=%s", url, headers, params)
+            BUCKET.acquire()
+            resp = http.get(url, headers=headers, params=params, proxies=proxies, timeout=20)
+            BUCKET.observe(resp.headers)
+            if resp.status_code == 429 or resp.status_code >= 500:
+                BUCKET.on_failure()
+            resp.raise_for_status()
+            BUCKET.on_success()
+            return orjson.loads(resp.content)
+        except requests.HTTPError as e:
+            logging.error(f"HTTP {e.response.status_code} on GET {url}: {e.response.text}")
+            if e.response.status_code != 429 and e.response.status_code < 500:
+                # Other client errors (bad request, not found, forbidden) will not succeed on retry
+                return None
+            if e.response.status_code in (429, 503):
+                retry_after = e.response.headers.get("Retry-After")
+        except requests.RequestException as e:
+            # Proxy, connection and timeout errors, and bodies cut off mid-transfer (ChunkedEncodingError)
+            logging.warning(f"Attempt {attempt}/{retries} network error: {e}")
+        except orjson.JSONDecodeError as e:
+            # A truncated body that still arrived with a complete framing
+            logging.warning(f"Attempt {attempt}/{retries} returned invalid JSON from {url}: {e}")
+        if attempt < retries:
+            wait = backoff_delay(attempt, delay, retry_after=retry_after)
+            logging.info(f"Retrying GET {url} in {wait:.1f}s (attempt {attempt}/{retries})")
+            time.sleep(wait)
+    logging.error(f"Giving up on GET {url} after {retries} attempts")
+    return None
+
+TOKEN_CACHE_PATH = os.path.expanduser("~/.vbrick_token.json")
+
+class VbrickAuthManager:
+    def __init__(self, base_url, api_key, api_secret, proxies=None, token_cache=TOKEN_CACHE_PATH):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.proxies = proxies
+        self.session = build_session()
+        self.token_cache = token_cache
+        self.token = None
+        self.token_created = 0
+        self.expires_in = 3600
+        self.lock = threading.Lock()
+        self._vbrick_headers = None
+        self.load_cached_token()
+
+    def _set_token(self, token, expires_in):
+        # Set auth headers once instead of rebuilding them per request
+        self.token = token
+        self.expires_in = expires_in
+        self.token_created = time.time()
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/json"
+        })
+        self._vbrick_headers = {"Authorization": f"VBrick {token}"}
+
+    def load_cached_token(self):
+        """Reuse a token persisted by an earlier run if it stays valid for at least 5 more minutes"""
+        if not self.token_cache:
+            return
+        try:
+            with open(self.token_cache) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return
+        if cached.get("base_url") != self.base_url or cached.get("api_key") != self.api_key:
+            return
+        remaining = cached.get("expires_at", 0) - time.time()
+        if not cached.get("token") or remaining <= 300:
+            return
+        self._set_token(cached["token"], remaining)
+        logging.info("Reusing cached token from %s; expires in %d seconds", self.token_cache, remaining)
+
+    def save_cached_token(self):
+        """Atomically persist the current token (owner-only permissions) for later runs"""
+        if not self.token_cache:
+            return
+        tmp_path = f"{self.token_cache}.tmp"
+        cached = {
+            "base_url": self.base_url,
+            "api_key": self.api_key,
+            "token": self.token,
+            "expires_at": self.token_created + self.expires_in
+        }
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(cached, f)
+            os.replace(tmp_path, self.token_cache)
+        except OSError as e:
+            logging.warning("Could not cache token to %s: %s", self.token_cache, e)
+
+    def token_expired(self):
+        """Refresh a minute early, but never let that margin eat more than half of a short-lived token"""
+        margin = min(60, self.expires_in / 2)
+        return not self.token or (time.time() - self.token_created) > (self.expires_in - margin)
+
+    def get_token(self):
+        # Double-checked locking so concurrent workers trigger a single refresh
+        if self.token_expired():
+            with self.lock:
+                if self.token_expired():
+                    self.refresh_token()
+        return self.token
+
+    def vbrick_headers(self):
+        """Headers for endpoints using the "VBrick" auth scheme; the dict is only rebuilt when the token changes"""
+        self.get_token()
+        return self._vbrick_headers
+
+    def refresh_token(self):
+        """Request a new access token; raises when authentication fails"""
+        url = f"{self.base_url}/api/v2/authenticate"
+        logging.info(f"Requesting new access token via {url}")
+
+        headers = {
+            "accept": "application/json",
+            "content-type": "application/json"
+        }
+        payload = {
+            "apiKey": self.api_key,
+            "apiSecret": self.api_secret
+        }
+
+        try:
+            resp = self.session.post(
+                url,
+                headers=headers,
+                json=payload,
+                proxies=self.proxies,
+                timeout=30
+            )
+            resp.raise_for_status()
+        except requests.HTTPError as e:
+            logging.error("Authentication failed %s: %s", e.response.status_code, e.response.text)
+            raise
+        data = orjson.loads(resp.content)
+
+        token = data.get("token")
+        if not token:
+            raise RuntimeError(f"No 'token' field in authentication response: {data}")
+
+        self._set_token(token, data.get("expiresIn", self.expires_in))
+        self.save_cached_token()
+        logging.info("obtained token; expires in %d seconds", self.expires_in)